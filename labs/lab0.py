@@ -1,59 +1,245 @@
-# No Imports Allowed!
-
-
-def backwards(sound):
-    sound_l = sound['left']
-    sound_r = sound['right']
-
-    len_l = len(sound_l)
-    len_r = len(sound_r)
+import io
+import os
+import sys
+import glob
+import json
+import mmap
+import shutil
+import tempfile
+import tracemalloc
+import math
+import time
+import cmath
+import wave
+import struct
+from array import array
+from operator import mul
+from itertools import chain, islice, repeat
+from functools import wraps
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
 
-    bl = []
-    br = []
-    brt = sound['rate']
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
-    for i in range(len_l):
-        bl.append(sound_l[len_l - 1 - i])
 
-    for j in range(len_r):
-        br.append(sound_r[len_r - 1 - j])
+def backwards(sound):
+    bl = _channel(sound, reversed(sound['left']))
+    br = _channel(sound, reversed(sound['right']))
 
-    return {'rate': brt, 'left': bl, 'right': br}      
+    return _sound(sound, sound['rate'], bl, br)
 
 
-def mix(sound1, sound2, p):
+def mix(sound1, sound2, p, resample=False):
     if sound1['rate'] != sound2['rate']:
-        return None
+        if not resample:
+            return None
+        sound2 = resampled(sound2, sound1['rate'])
 
     s1_l = sound1['left']
     s1_r = sound1['right']
     s2_l = sound2['left']
     s2_r = sound2['right']
 
-    len_m = min(len(s1_l), len(s2_l))
-    m_l=[]
-    m_r=[]
-    for i in range(len_m):
-        m_l.append(s1_l[i]*p + s2_l[i]*(1-p))
-        m_r.append(s1_r[i]*p + s2_r[i]*(1-p))
-    
-    return {'rate': sound1['rate'], 'left': m_l, 'right': m_r}   
+    q = 1-p
+    m_l = _channel(sound1, (l1*p + l2*q for l1, l2 in zip(s1_l, s2_l)))
+    m_r = _channel(sound1, (r1*p + r2*q for r1, r2 in zip(s1_r, s2_r)))
+
+    return _sound(sound1, sound1['rate'], m_l, m_r)
 
-def echo(sound, num_echos, delay, scale):
-    s_l = sound['left'][:]
-    s_r = sound['right'][:]
+def mix_tracks(tracks, gains=None, resample=True):
+    """
+    Mix any number of sounds, scaling track i by gains[i] (by default every
+    track gets an equal share).  Like mix, the result is as long as the
+    shortest track.  Tracks whose rate differs from that of the first track
+    are resampled to match it, or, if resample is False, None is returned.
+    """
+    if gains is None:
+        gains = [1 / len(tracks)] * len(tracks)
+    assert len(gains) == len(tracks), 'need one gain per track'
+    rate = tracks[0]['rate']
+    if any(track['rate'] != rate for track in tracks):
+        if not resample:
+            return None
+        tracks = [resampled(track, rate) for track in tracks]
+
+    out = []
+    for ch in ('left', 'right'):
+        g = gains[0]
+        acc = [x * g for x in tracks[0][ch]]
+        for track, g in zip(tracks[1:], gains[1:]):
+            acc = [a + x * g for a, x in zip(acc, track[ch])]
+        out.append(_channel(tracks[0], acc))
+    return _sound(tracks[0], rate, out[0], out[1])
+
+def echo(sound, num_echos, delay, scale, mode='direct'):
+    """
+    Add num_echos copies of the sound, each delayed by a further delay seconds
+    and scaled by a further factor of scale.  mode selects the engine:
+    'direct' adds every echo in turn (cost grows with num_echos), 'feedback'
+    uses a comb filter whose cost does not depend on num_echos, and 'fft'
+    convolves with the echo impulse response by FFT overlap-add.
+    """
+    if mode == 'feedback':
+        return echo_feedback(sound, num_echos, delay, scale)
+    if mode == 'fft':
+        return convolve(sound, echo_impulse(num_echos, round(delay * sound['rate']), scale))
+    assert mode == 'direct', 'unknown echo mode: %r' % mode
+
+    s_l = sound['left']
+    s_r = sound['right']
 
     sample_delay = round(delay * sound['rate'])
     sample_num = len(s_l) + sample_delay * num_echos
 
-    echo_l = [0]*sample_num
-    echo_r = [0]*sample_num
+    echo_l = _zeros(sound, sample_num)
+    echo_r = _zeros(sound, sample_num)
     for i in range(num_echos + 1):
+        offset = i * sample_delay
         for j in range(len(s_l)):
-            echo_l[j + i * sample_delay] += s_l[j] * (scale**i)
-            echo_r[j + i * sample_delay] += s_r[j] * (scale**i)
-    
-    return {'rate': sound['rate'], 'left': echo_l, 'right': echo_r} 
+            echo_l[j + offset] += s_l[j] * (scale**i)
+            echo_r[j + offset] += s_r[j] * (scale**i)
+
+    return _sound(sound, sound['rate'], echo_l, echo_r)
+
+
+# faster echo engines
+
+def echo_feedback(sound, num_echos, delay, scale):
+    """
+    Echo using a feed-back comb filter: every output sample is the input
+    sample plus scale times the output sample one delay earlier, minus the
+    contribution that would have become echo number num_echos + 1.  Each
+    output sample therefore costs the same however many echoes there are.
+    """
+    sample_delay = round(delay * sound['rate'])
+    out = []
+    for x in (sound['left'], sound['right']):
+        if sample_delay == 0:
+            gain = sum(scale**i for i in range(num_echos + 1))
+            out.append(_channel(sound, (i * gain for i in x)))
+        else:
+            out.append(_channel(sound, _comb(x, num_echos, sample_delay, scale)))
+    return _sound(sound, sound['rate'], out[0], out[1])
+
+def _comb(x, num_echos, sample_delay, scale):
+    """
+    Run the truncated comb filter over one channel, one delay-length chunk at
+    a time (each chunk only depends on the previous one).
+    """
+    d = sample_delay
+    cut = (num_echos + 1) * d
+    g = scale**(num_echos + 1)
+    padded = list(x) + [0] * (num_echos * d)
+    n = len(padded)
+
+    if numpy is not None:
+        xp = numpy.asarray(padded, dtype=float)
+        y = xp.copy()
+        for start in range(d, n, d):
+            stop = min(start + d, n)
+            y[start:stop] += scale * y[start - d:stop - d]
+            if start >= cut:
+                y[start:stop] -= g * xp[start - cut:stop - cut]
+        return y.tolist()
+
+    y = padded[:d]
+    for start in range(d, n, d):
+        seg = padded[start:start + d]
+        prev = y[start - d:start - d + len(seg)]
+        if start >= cut:
+            old = padded[start - cut:start - cut + len(seg)]
+            y.extend([a + scale * b - g * c for a, b, c in zip(seg, prev, old)])
+        else:
+            y.extend([a + scale * b for a, b in zip(seg, prev)])
+    return y
+
+def echo_impulse(num_echos, sample_delay, scale):
+    """
+    Return the impulse response of echo as a list: scale**i at sample
+    i * sample_delay, for i from 0 to num_echos.
+    """
+    impulse = [0] * (num_echos * sample_delay + 1)
+    for i in range(num_echos + 1):
+        impulse[i * sample_delay] += scale**i
+    return impulse
+
+def convolve(sound, impulse, block_size=None):
+    """
+    Convolve both channels of the sound with the given impulse response (a
+    list of floats) by FFT overlap-add.  The output is len(impulse) - 1
+    samples longer than the input.
+    """
+    s_l = sound['left']
+    s_r = sound['right']
+    n = len(s_l)
+    m = len(impulse)
+    if block_size is None:
+        block_size = max(m, 1024)
+    size = 1
+    while size < block_size + m - 1:
+        size *= 2
+    block_size = size - m + 1
+
+    out_l = [0.0] * (n + m - 1)
+    out_r = [0.0] * (n + m - 1)
+
+    if numpy is not None:
+        h = numpy.fft.rfft(numpy.asarray(impulse, dtype=float), size)
+        for start in range(0, n, block_size):
+            stop = min(start + block_size, n)
+            for x, out in ((s_l, out_l), (s_r, out_r)):
+                y = numpy.fft.irfft(numpy.fft.rfft(numpy.asarray(x[start:stop], dtype=float), size) * h, size)
+                y = y[:stop - start + m - 1].tolist()
+                out[start:start + len(y)] = [a + b for a, b in zip(out[start:start + len(y)], y)]
+    else:
+        # both channels at once: left as the real part, right as the imaginary
+        # part (the impulse response is real, so they do not interfere)
+        h = _fft([complex(i) for i in impulse] + [0j] * (size - m))
+        for start in range(0, n, block_size):
+            stop = min(start + block_size, n)
+            z = [complex(l, r) for l, r in zip(s_l[start:stop], s_r[start:stop])]
+            z = _fft([a * b for a, b in zip(_fft(z + [0j] * (size - len(z))), h)], invert=True)
+            z = z[:stop - start + m - 1]
+            end = start + len(z)
+            out_l[start:end] = [a + b.real for a, b in zip(out_l[start:end], z)]
+            out_r[start:end] = [a + b.imag for a, b in zip(out_r[start:end], z)]
+
+    return _sound(sound, sound['rate'], _channel(sound, out_l), _channel(sound, out_r))
+
+def _fft(a, invert=False):
+    """
+    Iterative radix-2 FFT of a list of complex numbers whose length is a power
+    of two.  With invert=True, compute the inverse transform instead.
+    """
+    a = list(a)
+    n = len(a)
+    j = 0
+    for i in range(1, n):
+        bit = n >> 1
+        while j & bit:
+            j ^= bit
+            bit >>= 1
+        j |= bit
+        if i < j:
+            a[i], a[j] = a[j], a[i]
+    length = 2
+    sign = 1 if invert else -1
+    while length <= n:
+        half = length // 2
+        twiddles = [cmath.exp(sign * 2j * math.pi * k / length) for k in range(half)]
+        for start in range(0, n, length):
+            for k in range(half):
+                u = a[start + k]
+                v = a[start + k + half] * twiddles[k]
+                a[start + k] = u + v
+                a[start + k + half] = u - v
+        length *= 2
+    if invert:
+        a = [i / n for i in a]
+    return a
 
 def pan(sound):
     s_l = sound['left']
@@ -61,84 +247,1183 @@ def pan(sound):
 
     s_len = len(s_l)
 
-    p_l = []
-    p_r = []
-
-    for i in range(s_len):
-        p_l.append(s_l[i] * (s_len-1-i) / (s_len-1))
-        p_r.append(s_r[i] * i / (s_len-1))
+    p_l = _channel(sound, (s_l[i] * (s_len-1-i) / (s_len-1) for i in range(s_len)))
+    p_r = _channel(sound, (s_r[i] * i / (s_len-1) for i in range(s_len)))
 
-    return {'rate': sound['rate'], 'left': p_l, 'right': p_r} 
+    return _sound(sound, sound['rate'], p_l, p_r)
 
 def remove_vocals(sound):
     s_l = sound['left']
     s_r = sound['right']
 
-    s_len = len(s_l)
+    rv_l = _channel(sound, (l - r for l, r in zip(s_l, s_r)))
+    rv_r = _channel(sound, rv_l) if isinstance(sound, Sound) else rv_l
+
+    return _sound(sound, sound['rate'], rv_l, rv_r)
+
+
+# streaming versions of the effects above: each one takes an iterable of
+# blocks (sounds of a few thousand samples, e.g. from load_wav_blocks) and
+# lazily yields output blocks, so that a pipeline such as
+#
+#   write_wav_blocks(echo_blocks(pan_blocks(load_wav_blocks('car.wav'),
+#                                           wav_length('car.wav')),
+#                                5, 0.3, 0.6),
+#                    'echo.wav')
+#
+# only ever holds a few blocks in memory, however long the file is
+
+def _slice(sound, start, stop=None):
+    return _sound(sound, sound['rate'], sound['left'][start:stop], sound['right'][start:stop])
+
+def _aligned(blocks1, blocks2):
+    """
+    Pair up the blocks of two streams so that both blocks of every pair have
+    the same length, stopping as soon as either stream runs out.
+    """
+    it1 = iter(blocks1)
+    it2 = iter(blocks2)
+    b1 = b2 = None
+    while True:
+        while b1 is None or len(b1['left']) == 0:
+            b1 = next(it1, None)
+            if b1 is None:
+                return
+        while b2 is None or len(b2['left']) == 0:
+            b2 = next(it2, None)
+            if b2 is None:
+                return
+        n = min(len(b1['left']), len(b2['left']))
+        yield _slice(b1, 0, n), _slice(b2, 0, n)
+        b1 = _slice(b1, n)
+        b2 = _slice(b2, n)
+
+def mix_blocks(blocks1, blocks2, p):
+    for b1, b2 in _aligned(blocks1, blocks2):
+        mixed = mix(b1, b2, p)
+        if mixed is None:
+            raise ValueError('cannot mix sounds with different rates')
+        yield mixed
+
+def pan_blocks(blocks, length):
+    """
+    Pan a stream whose total length (in samples) is known in advance.
+    """
+    start = 0
+    for block in blocks:
+        s_l = block['left']
+        s_r = block['right']
+        idx = range(start, start + len(s_l))
+        p_l = _channel(block, (l * (length-1-i) / (length-1) for l, i in zip(s_l, idx)))
+        p_r = _channel(block, (r * i / (length-1) for r, i in zip(s_r, idx)))
+        start += len(s_l)
+        yield _sound(block, block['rate'], p_l, p_r)
+
+def remove_vocals_blocks(blocks):
+    for block in blocks:
+        yield remove_vocals(block)
+
+def echo_blocks(blocks, num_echos, delay, scale):
+    """
+    Echo a stream, carrying the last delay * num_echos input samples between
+    blocks.  After the input ends, one more block holding the echo tail is
+    produced, so the output is as long as that of echo.
+    """
+    last = None
+    for block in _with_tail(blocks):
+        if block is None and last is None:
+            return
+        if last is None:
+            sample_delay = round(delay * block['rate'])
+            span = sample_delay * num_echos
+            history = {'left': [0] * span, 'right': [0] * span}
+        if block is None:
+            if span == 0:
+                return
+            block = _sound(last, last['rate'], [0] * span, [0] * span)
+        last = block
+
+        out = {}
+        for ch in ('left', 'right'):
+            x = history[ch] + list(block[ch])
+            n = len(x) - span
+            y = [0] * n
+            for i in range(num_echos + 1):
+                offset = span - i * sample_delay
+                s = scale**i
+                y = [a + b * s for a, b in zip(y, x[offset:offset + n])]
+            history[ch] = x[n:]
+            out[ch] = _channel(block, y)
+        yield _sound(block, block['rate'], out['left'], out['right'])
+
+def _with_tail(blocks):
+    yield from blocks
+    yield None
+
+
+# resampling: a polyphase windowed-sinc resampler.  For a conversion from rate
+# a to rate b = a * L / M (L / M in lowest terms), output sample m lies at
+# input position m * M / L; its value is a weighted sum of the 2 * half input
+# samples around that position, with weights taken from one of L precomputed
+# phases of a Hann-windowed sinc low-pass filter.  Input can be fed in blocks
+# of any size, so the same code serves whole sounds and streams.
+
+class Resampler:
+    """
+    Streaming resampler for one channel from rate old to rate new.  Feed it
+    blocks of samples with process; pass final=True with the last block to
+    flush the remaining output.
+    """
+    def __init__(self, old, new, taps=16):
+        g = math.gcd(old, new)
+        self.up = new // g
+        self.down = old // g
+        cutoff = min(1.0, self.up / self.down)
+        self.half = math.ceil(taps / cutoff)
+        self.phases = [_sinc_weights(phase / self.up, self.half, cutoff)
+                       for phase in range(self.up)]
+        self.buffer = [0.0] * self.half  # buffer[0] is input sample offset
+        self.offset = -self.half
+        self.consumed = 0
+        self.produced = 0
+
+    def process(self, samples, final=False):
+        self.buffer.extend(samples)
+        self.consumed += len(samples)
+        if final:
+            self.buffer.extend([0.0] * (self.half + 1))
+            limit = (self.consumed * self.up + self.down - 1) // self.down
+        else:
+            # output m needs input up to index m * down // up + half
+            limit = ((self.consumed - self.half) * self.up + self.down - 1) // self.down
+        buf = self.buffer
+        span = 2 * self.half
+        out = []
+        for m in range(self.produced, max(limit, self.produced)):
+            base, phase = divmod(m * self.down, self.up)
+            start = base - self.half + 1 - self.offset
+            out.append(sum(map(mul, buf[start:start + span], self.phases[phase])))
+        self.produced += len(out)
+
+        keep = (self.produced * self.down) // self.up - self.half + 1
+        if keep > self.offset:
+            del buf[:keep - self.offset]
+            self.offset = keep
+        return out
+
+
+def _sinc_weights(frac, half, cutoff):
+    """
+    Weights of the windowed-sinc filter for the input samples at offsets
+    -half + 1 to half from a position frac of the way between two samples,
+    normalised so that a constant signal is unchanged.
+    """
+    weights = []
+    for j in range(-half + 1, half + 1):
+        u = j - frac
+        x = math.pi * cutoff * u
+        sinc = 1.0 if x == 0 else math.sin(x) / x
+        window = 0.5 * (1 + math.cos(math.pi * u / half)) if abs(u) < half else 0.0
+        weights.append(cutoff * sinc * window)
+    total = sum(weights)
+    return [w / total for w in weights]
+
+
+def resampled(sound, rate, taps=16):
+    """
+    Return the given sound converted to the given sample rate.
+    """
+    if sound['rate'] == rate:
+        return sound
+    left = Resampler(sound['rate'], rate, taps).process(sound['left'], final=True)
+    right = Resampler(sound['rate'], rate, taps).process(sound['right'], final=True)
+    return _sound(sound, rate, _channel(sound, left), _channel(sound, right))
+
+
+def resample_blocks(blocks, rate, taps=16):
+    """
+    Streaming version of resampled, for a stream of blocks.
+    """
+    resamplers = None
+    last = None
+    for block in _with_tail(blocks):
+        if block is None:
+            if last is None:
+                return
+            left = resamplers[0].process([], final=True)
+            right = resamplers[1].process([], final=True)
+            block = last
+        else:
+            if resamplers is None:
+                resamplers = (Resampler(block['rate'], rate, taps),
+                              Resampler(block['rate'], rate, taps))
+            left = resamplers[0].process(block['left'])
+            right = resamplers[1].process(block['right'])
+            last = block
+        yield _sound(block, rate, _channel(block, left), _channel(block, right))
+
+
+# lazy effect graphs: lazy(sound) (or lazy_wav(filename)) wraps a sound in a
+# node whose methods build further nodes instead of computing anything, e.g.
+#
+#   lazy_wav('car.wav').echo(5, 0.3, 0.6).pan().write('car_echo_pan.wav')
+#
+# Nothing is computed until the graph is rendered or written; then every block
+# of output samples is pulled through the whole chain at once, so no
+# full-length intermediate sound is ever allocated.
+
+class LazySound:
+    """
+    A node in a lazy effect graph.  Subclasses provide rate, length and
+    _samples(start, stop), which returns the (left, right) lists of output
+    samples for a range within [0, length).
+    """
+    def samples(self, start, stop):
+        """
+        Return the (left, right) lists of output samples from start to stop;
+        samples outside the sound are silent.
+        """
+        lo = max(start, 0)
+        hi = min(stop, self.length)
+        if lo >= hi:
+            return [0] * (stop - start), [0] * (stop - start)
+        left, right = self._samples(lo, hi)
+        if lo == start and hi == stop:
+            return left, right
+        before = [0] * (lo - start)
+        after = [0] * (stop - hi)
+        return before + left + after, before + right + after
+
+    def backwards(self):
+        return _Backwards(self)
+
+    def mix(self, other, p):
+        return _Mix(self, other, p)
+
+    def echo(self, num_echos, delay, scale):
+        return _Echo(self, num_echos, delay, scale)
+
+    def pan(self):
+        return _Pan(self)
+
+    def remove_vocals(self):
+        return _RemoveVocals(self)
+
+    def blocks(self, block_size=4096, compact=False):
+        """
+        Lazily yield the output of this graph as blocks of sounds.
+        """
+        for start in range(0, self.length, block_size):
+            left, right = self.samples(start, min(start + block_size, self.length))
+            if compact:
+                yield Sound(self.rate, left, right)
+            else:
+                yield {'rate': self.rate, 'left': left, 'right': right}
+
+    def render(self, compact=False):
+        """
+        Compute the whole output of this graph as a single sound.
+        """
+        left, right = self.samples(0, self.length)
+        if compact:
+            return Sound(self.rate, left, right)
+        return {'rate': self.rate, 'left': left, 'right': right}
+
+    def write(self, filename, block_size=4096):
+        """
+        Write the output of this graph to a WAV file block by block.
+        """
+        return write_wav_blocks(self.blocks(block_size), filename, self.rate)
+
+
+def lazy(sound):
+    """
+    Wrap a sound (a dictionary or a compact Sound) as a lazy effect graph.
+    """
+    return _Source(sound)
+
+
+def lazy_wav(filename):
+    """
+    Wrap a WAV file as a lazy effect graph; samples are only read from disk
+    when they are needed.
+    """
+    return _WavSource(filename)
+
+
+class _Source(LazySound):
+    def __init__(self, sound):
+        self.sound = sound
+        self.rate = sound['rate']
+        self.length = len(sound['left'])
 
-    rv_l = []
-    rv_r = []
+    def _samples(self, start, stop):
+        return (list(self.sound['left'][start:stop]),
+                list(self.sound['right'][start:stop]))
 
-    for i in range(s_len):
-        rv_l.append(s_l[i]-s_r[i])
-        rv_r = rv_l
 
-    return {'rate': sound['rate'], 'left': rv_l, 'right': rv_r}     
+class _WavSource(LazySound):
+    def __init__(self, filename):
+        self.filename = filename
+        with wave.open(filename, 'r') as f:
+            chan, bd, sr, count, _, _ = f.getparams()
+        assert bd == 2, "only 16-bit WAV files are supported"
+        self.rate = sr
+        self.length = count
+
+    def _samples(self, start, stop):
+        with wave.open(self.filename, 'r') as f:
+            f.setpos(start)
+            return _decode_frames(f.readframes(stop - start), f.getnchannels())
+
+
+class _Backwards(LazySound):
+    def __init__(self, node):
+        self.node = node
+        self.rate = node.rate
+        self.length = node.length
+
+    def _samples(self, start, stop):
+        left, right = self.node.samples(self.length - stop, self.length - start)
+        return left[::-1], right[::-1]
+
+
+class _Mix(LazySound):
+    def __init__(self, node1, node2, p):
+        if node1.rate != node2.rate:
+            raise ValueError('cannot mix sounds with different rates')
+        self.nodes = (node1, node2)
+        self.p = p
+        self.rate = node1.rate
+        self.length = min(node1.length, node2.length)
+
+    def _samples(self, start, stop):
+        l1, r1 = self.nodes[0].samples(start, stop)
+        l2, r2 = self.nodes[1].samples(start, stop)
+        p = self.p
+        q = 1-p
+        return ([a*p + b*q for a, b in zip(l1, l2)],
+                [a*p + b*q for a, b in zip(r1, r2)])
+
+
+class _Echo(LazySound):
+    """
+    Echo node with a delay line: it keeps the last sample_delay * num_echos
+    samples of its input, so when blocks are requested in order (as blocks
+    and write do) each input sample is pulled from the node below only once.
+    Any other request pulls the input window it needs in one call.
+    """
+    def __init__(self, node, num_echos, delay, scale):
+        self.node = node
+        self.num_echos = num_echos
+        self.scale = scale
+        self.sample_delay = round(delay * node.rate)
+        self.rate = node.rate
+        self.length = node.length + self.sample_delay * num_echos
+        self.span = self.sample_delay * num_echos
+        self._next = None
+        self._history = None
+
+    def _samples(self, start, stop):
+        span = self.span
+        if start == self._next:
+            hist_l, hist_r = self._history
+        else:
+            hist_l, hist_r = self.node.samples(start - span, start)
+        left, right = self.node.samples(start, stop)
+        n = stop - start
+        out = []
+        for x in (hist_l + left, hist_r + right):
+            y = [0] * n
+            for i in range(self.num_echos + 1):
+                offset = span - i * self.sample_delay
+                s = self.scale**i
+                y = [a + b*s for a, b in zip(y, x[offset:offset + n])]
+            out.append(y)
+            out.append(x[len(x) - span:])
+        self._next = stop
+        self._history = (out[1], out[3])
+        return out[0], out[2]
+
+
+class _Pan(LazySound):
+    def __init__(self, node):
+        self.node = node
+        self.rate = node.rate
+        self.length = node.length
+
+    def _samples(self, start, stop):
+        left, right = self.node.samples(start, stop)
+        n = self.length
+        return ([l * (n-1-i) / (n-1) for l, i in zip(left, range(start, stop))],
+                [r * i / (n-1) for r, i in zip(right, range(start, stop))])
+
+
+class _RemoveVocals(LazySound):
+    def __init__(self, node):
+        self.node = node
+        self.rate = node.rate
+        self.length = node.length
+
+    def _samples(self, start, stop):
+        left, right = self.node.samples(start, stop)
+        rv = [l - r for l, r in zip(left, right)]
+        return rv, rv[:]
 
 
 # below are helper functions for converting back-and-forth between WAV files
-# and our internal dictionary representation for sounds
+# and our internal representations for sounds: the dictionary of lists used by
+# the effects above, and the compact Sound type backed by array('d') buffers
+
+class Sound:
+    """
+    Compact representation of a stereo sound.  The 'left' and 'right'
+    channels are array('d') buffers (8 bytes per sample instead of a boxed
+    Python float each), and the object can be indexed with 'rate', 'left' and
+    'right' exactly like the dictionary representation, so every effect above
+    accepts either form and returns the same form it was given.
+    """
+    __slots__ = ('rate', 'left', 'right')
+
+    def __init__(self, rate, left, right):
+        self.rate = rate
+        self.left = _as_samples(left)
+        self.right = _as_samples(right)
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        setattr(self, key, value if key == 'rate' else _as_samples(value))
+
+    def __len__(self):
+        return len(self.left)
+
+    def __eq__(self, other):
+        try:
+            other['rate'], other['left'], other['right']
+        except (TypeError, KeyError, IndexError):
+            return NotImplemented
+        return (self['rate'] == other['rate'] and
+                list(self.left) == list(other['left']) and
+                list(self.right) == list(other['right']))
+
+    def __repr__(self):
+        return 'Sound(rate=%r, samples=%r)' % (self.rate, len(self.left))
+
+    def keys(self):
+        return self.__slots__
+
+    @classmethod
+    def from_dict(cls, sound):
+        """
+        Build a compact Sound from the dictionary representation.
+        """
+        return cls(sound['rate'], sound['left'], sound['right'])
+
+    def to_dict(self):
+        """
+        Return the dictionary representation (lists of floats) of this sound.
+        """
+        return {'rate': self.rate, 'left': self.left.tolist(), 'right': self.right.tolist()}
+
+    @classmethod
+    def from_pcm(cls, rate, pcm, channels=2):
+        """
+        Build a Sound from interleaved signed 16-bit samples, given either as
+        an array('h') or as little-endian bytes.  Mono input is duplicated
+        into both channels.
+        """
+        if isinstance(pcm, array):
+            pcm = _little_endian(pcm)
+        left, right = _decode_frames(pcm, channels, compact=True)
+        return cls(rate, left, right)
+
+    def to_pcm(self):
+        """
+        Return the samples of this sound as interleaved, clipped signed
+        16-bit values in an array('h'), as they would be written to a WAV file.
+        """
+        pcm = array('h', _encode_frames(self))
+        if sys.byteorder == 'big':
+            pcm.byteswap()
+        return pcm
+
+
+def _as_samples(samples):
+    """
+    Return the given channel as an array('d'), copying only if necessary.
+    """
+    if isinstance(samples, array) and samples.typecode == 'd':
+        return samples
+    return array('d', samples)
+
+
+def _channel(sound, samples):
+    """
+    Build one output channel from an iterable of samples, in the
+    representation matching the given input sound.
+    """
+    if isinstance(sound, Sound):
+        return array('d', samples)
+    return list(samples)
 
-import io
-import wave
-import struct
 
-def load_wav(filename):
+def _zeros(sound, n):
+    """
+    Return a silent channel of n samples matching the given input sound.
+    """
+    if isinstance(sound, Sound):
+        return array('d', bytes(8 * n))
+    return [0] * n
+
+
+def _sound(sound, rate, left, right):
+    """
+    Package output channels in the same representation as the input sound.
+    """
+    if isinstance(sound, Sound):
+        return Sound(rate, left, right)
+    return {'rate': rate, 'left': left, 'right': right}
+
+
+def load_wav(filename, compact=False):
     """
     Given the filename of a WAV file, load the data from that file and return a
-    Python dictionary representing that sound
+    Python dictionary representing that sound.  If compact is True, return a
+    Sound backed by array('d') buffers instead.
     """
     f = wave.open(filename, 'r')
     chan, bd, sr, count, _, _ = f.getparams()
 
     assert bd == 2, "only 16-bit WAV files are supported"
 
-    left = []
-    right = []
-    for i in range(count):
-        frame = f.readframes(1)
-        if chan == 2:
-            left.append(struct.unpack('<h', frame[:2])[0])
-            right.append(struct.unpack('<h', frame[2:])[0])
-        else:
-            datum = struct.unpack('<h', frame)[0]
-            left.append(datum)
-            right.append(datum)
-
-    left = [i/(2**15) for i in left]
-    right = [i/(2**15) for i in right]
+    left, right = _decode_frames(f.readframes(count), chan, compact)
+    f.close()
 
+    if compact:
+        return Sound(sr, left, right)
     return {'rate': sr, 'left': left, 'right': right}
 
 
+def load_wav_blocks(filename, block_size=4096, compact=False):
+    """
+    Given the filename of a WAV file, lazily yield the sound in that file as a
+    sequence of blocks of (at most) block_size samples, each one in the same
+    representation load_wav would return.
+    """
+    f = wave.open(filename, 'r')
+    try:
+        chan, bd, sr, count, _, _ = f.getparams()
+        assert bd == 2, "only 16-bit WAV files are supported"
+        while True:
+            frames = f.readframes(block_size)
+            if not frames:
+                break
+            left, right = _decode_frames(frames, chan, compact)
+            if compact:
+                yield Sound(sr, left, right)
+            else:
+                yield {'rate': sr, 'left': left, 'right': right}
+    finally:
+        f.close()
+
+
+def wav_length(filename):
+    """
+    Return the number of samples (per channel) in the given WAV file.
+    """
+    with wave.open(filename, 'r') as f:
+        return f.getnframes()
+
+
+def _decode_frames(frames, chan, compact=False):
+    """
+    Convert raw little-endian 16-bit frames into left and right channels of
+    floats in [-1, 1] (lists, or array('d') buffers if compact is True).  The
+    whole buffer is decoded and scaled at once, with NumPy if it is available.
+    """
+    if numpy is not None:
+        raw = numpy.frombuffer(frames, dtype='<i2')
+        if compact:
+            # scale straight into the output buffers, with no float copy of
+            # the interleaved samples
+            channels = []
+            for start in range(chan):
+                out = array('d', bytes(8 * (len(raw) // chan)))
+                view = numpy.frombuffer(out, dtype=float)
+                numpy.multiply(raw[start::chan], 2**-15, out=view)
+                channels.append(out)
+            return channels[0], channels[-1] if chan == 2 else channels[0][:]
+        samples = raw * (2**-15)
+        left = samples[0::chan]
+        right = samples[1::chan] if chan == 2 else left
+        return left.tolist(), right.tolist()
+
+    if sys.byteorder == 'little':
+        samples = memoryview(frames).cast('B').cast('h')
+    else:
+        samples = array('h', frames)
+        samples.byteswap()
+    build = (lambda it: array('d', it)) if compact else list
+    left = build(map((2**-15).__mul__, samples[0::chan]))
+    if chan == 2:
+        right = build(map((2**-15).__mul__, samples[1::chan]))
+    else:
+        right = left[:]
+    return left, right
+
+
+def _encode_frames(sound):
+    """
+    Convert a sound into raw interleaved little-endian 16-bit stereo frames,
+    clipping and scaling each channel as a whole.
+    """
+    left = sound['left']
+    right = sound['right']
+    n = min(len(left), len(right))
+
+    if numpy is not None:
+        out = numpy.empty(2 * n, dtype='<i2')
+        for start, channel in ((0, left), (1, right)):
+            samples = numpy.asarray(channel[:n], dtype=float)
+            out[start::2] = (numpy.clip(samples, -1, 1) * (2**15-1)).astype('<i2')
+        return out.tobytes()
+
+    out = array('h', bytes(4 * n))
+    for start, channel in ((0, left), (1, right)):
+        clipped = map(max, repeat(-1), map(min, repeat(1), islice(channel, n)))
+        out[start::2] = array('h', map(int, map(float(2**15-1).__mul__, clipped)))
+    if sys.byteorder == 'big':
+        out.byteswap()
+    return out.tobytes()
+
+
+def _little_endian(pcm):
+    """
+    Return the bytes of an array('h') of samples in little-endian order.
+    """
+    if sys.byteorder == 'big':
+        pcm = array('h', pcm)
+        pcm.byteswap()
+    return pcm.tobytes()
+
+
 def write_wav(sound, filename):
     """
-    Given a dictionary representing a sound, and a filename, convert the given
-    sound into WAV format and save it as a file with the given filename (which
+    Given a sound (a dictionary or a compact Sound), and a filename, convert the
+    given sound into WAV format and save it as a file with the given filename (which
     can then be opened by most audio players)
     """
     outfile = wave.open(filename, 'w')
     outfile.setparams((2, 2, sound['rate'], 0, 'NONE', 'not compressed'))
+    outfile.writeframes(_encode_frames(sound))
+    outfile.close()
 
-    out = []
-    for l, r in zip(sound['left'], sound['right']):
-        l = int(max(-1, min(1, l)) * (2**15-1))
-        r = int(max(-1, min(1, r)) * (2**15-1))
-        out.append(l)
-        out.append(r)
 
-    outfile.writeframes(b''.join(struct.pack('<h', frame) for frame in out))
-    outfile.close()
+def write_wav_blocks(blocks, filename, rate=None):
+    """
+    Given an iterable of blocks (as produced by load_wav_blocks or by the
+    streaming effects), write each block to the given WAV file as soon as it
+    is produced.  Returns the number of samples written.  The file's rate is
+    that of the first block; for an empty stream an empty WAV file is still
+    written, at the given rate (44100 if none is given).
+    """
+    blocks = iter(blocks)
+    first = next(blocks, None)
+    if first is not None:
+        rate = first['rate']
+    elif rate is None:
+        rate = 44100
+    outfile = wave.open(filename, 'w')
+    written = 0
+    try:
+        outfile.setparams((2, 2, rate, 0, 'NONE', 'not compressed'))
+        if first is not None:
+            for block in chain([first], blocks):
+                outfile.writeframes(_encode_frames(block))
+                written += len(block['left'])
+    finally:
+        outfile.close()
+    return written
+
+
+# in-place effects on memory-mapped WAV files: these work directly on the
+# 16-bit PCM data of the file, one block of frames at a time, so files larger
+# than memory can be processed.  Given an out_filename, the input is first
+# copied there and the copy is modified; otherwise the file itself is changed.
+# Samples stay integers throughout (pan truncates towards zero and
+# remove_vocals saturates), so no float conversion takes place.
+
+def _wav_data(buf):
+    """
+    Given the bytes of a WAV file, return (channels, offset, size) of its
+    PCM data chunk.
+    """
+    assert buf[0:4] == b'RIFF' and buf[8:12] == b'WAVE', 'not a WAV file'
+    pos = 12
+    chan = None
+    while pos + 8 <= len(buf):
+        chunk = buf[pos:pos + 4]
+        size = struct.unpack('<I', buf[pos + 4:pos + 8])[0]
+        if chunk == b'fmt ':
+            fmt, chan, _, _, _, bits = struct.unpack('<HHIIHH', buf[pos + 8:pos + 24])
+            assert fmt == 1 and bits == 16, "only 16-bit WAV files are supported"
+        elif chunk == b'data':
+            assert chan is not None, 'WAV data chunk before fmt chunk'
+            return chan, pos + 8, min(size, len(buf) - pos - 8)
+        pos += 8 + size + (size % 2)
+    raise ValueError('WAV file has no data chunk')
+
+
+@contextmanager
+def _mapped_pcm(filename, out_filename=None):
+    """
+    Memory-map the given WAV file (or a copy of it at out_filename) and yield
+    (channels, samples), where samples is a writable memoryview of its
+    interleaved 16-bit PCM data.
+    """
+    if out_filename is not None:
+        shutil.copyfile(filename, out_filename)
+        filename = out_filename
+    with open(filename, 'r+b') as f, mmap.mmap(f.fileno(), 0) as mm:
+        chan, offset, size = _wav_data(mm)
+        data = memoryview(mm)[offset:offset + size - size % (2 * chan)]
+        samples = data.cast('h')
+        try:
+            yield chan, samples
+        finally:
+            samples.release()
+            data.release()
+            mm.flush()
+
+
+def _read_block(samples, start, stop):
+    block = array('h')
+    block.frombytes(samples[start:stop].cast('B'))
+    if sys.byteorder == 'big':
+        block.byteswap()
+    return block
+
+
+def _write_block(samples, start, block):
+    if sys.byteorder == 'big':
+        block.byteswap()
+    samples[start:start + len(block)] = block
+
+
+def _reverse_frames(block, chan):
+    """
+    Reverse the order of the frames in an interleaved block of samples.
+    """
+    rev = block[::-1]
+    if chan == 1:
+        return rev
+    out = array('h', rev)
+    for c in range(chan):
+        out[c::chan] = rev[chan-1-c::chan]
+    return out
+
+
+def backwards_mmap(filename, out_filename=None, block_size=65536):
+    with _mapped_pcm(filename, out_filename) as (chan, samples):
+        step = block_size * chan
+        front = 0
+        back = len(samples)
+        while back - front >= 2 * step:
+            head = _read_block(samples, front, front + step)
+            tail = _read_block(samples, back - step, back)
+            _write_block(samples, front, _reverse_frames(tail, chan))
+            _write_block(samples, back - step, _reverse_frames(head, chan))
+            front += step
+            back -= step
+        middle = _read_block(samples, front, back)
+        _write_block(samples, front, _reverse_frames(middle, chan))
+
+
+def pan_mmap(filename, out_filename=None, block_size=65536):
+    with _mapped_pcm(filename, out_filename) as (chan, samples):
+        assert chan == 2, 'only stereo files can be panned in place'
+        n = len(samples) // 2
+        for start in range(0, n, block_size):
+            stop = min(start + block_size, n)
+            block = _read_block(samples, 2 * start, 2 * stop)
+            idx = range(start, stop)
+            block[0::2] = array('h', (int(l * (n-1-i) / (n-1)) for l, i in zip(block[0::2], idx)))
+            block[1::2] = array('h', (int(r * i / (n-1)) for r, i in zip(block[1::2], idx)))
+            _write_block(samples, 2 * start, block)
+
+
+def remove_vocals_mmap(filename, out_filename=None, block_size=65536):
+    with _mapped_pcm(filename, out_filename) as (chan, samples):
+        assert chan == 2, 'only stereo files can have vocals removed in place'
+        for start in range(0, len(samples), 2 * block_size):
+            block = _read_block(samples, start, start + 2 * block_size)
+            _write_block(samples, start, _remove_vocals_frames(block))
+
+
+# integer fixed-point versions of some effects: a PCM sound is a dictionary
+# {'rate': ..., 'pcm': array('h')} of interleaved 16-bit stereo samples, as
+# returned by load_wav_pcm.  These effects never convert to floats; they work
+# on whole buffers with saturating integer arithmetic (using NumPy when it is
+# available), and a PCM sound takes a quarter of the memory of a Sound.
+
+def load_wav_pcm(filename):
+    """
+    Given the filename of a WAV file, return its samples as a PCM sound.
+    """
+    with wave.open(filename, 'r') as f:
+        chan, bd, sr, count, _, _ = f.getparams()
+        assert bd == 2, "only 16-bit WAV files are supported"
+        frames = f.readframes(count)
+    pcm = array('h', frames)
+    if sys.byteorder == 'big':
+        pcm.byteswap()
+    if chan == 1:
+        stereo = array('h', bytes(4 * len(pcm)))
+        stereo[0::2] = pcm
+        stereo[1::2] = pcm
+        pcm = stereo
+    return {'rate': sr, 'pcm': pcm}
+
+
+def write_wav_pcm(sound, filename):
+    """
+    Write a PCM sound to the given WAV file.
+    """
+    with wave.open(filename, 'w') as outfile:
+        outfile.setparams((2, 2, sound['rate'], 0, 'NONE', 'not compressed'))
+        outfile.writeframes(_little_endian(sound['pcm']))
+
+
+def backwards_pcm(sound):
+    return {'rate': sound['rate'], 'pcm': _reverse_frames(sound['pcm'], 2)}
+
+
+def remove_vocals_pcm(sound):
+    return {'rate': sound['rate'], 'pcm': _remove_vocals_frames(sound['pcm'])}
+
+
+def mix_pcm(sound1, sound2, p):
+    """
+    Mix two PCM sounds.  p must be a dyadic fraction k / 2**s with s <= 16
+    (e.g. 0.5, 0.25, 0.375), so that the mix can be computed exactly as
+    (k * a + (2**s - k) * b) / 2**s in integers; the result is rounded half
+    up and saturated to 16 bits.
+    """
+    if sound1['rate'] != sound2['rate']:
+        return None
+    k, den = float(p).as_integer_ratio()
+    shift = den.bit_length() - 1
+    if shift > 16:
+        raise ValueError('mix_pcm needs a dyadic gain with at most 16 fractional bits, got %r' % p)
+
+    a = sound1['pcm']
+    b = sound2['pcm']
+    n = min(len(a), len(b))
+    half = den // 2
+    if numpy is not None:
+        x = numpy.frombuffer(a, dtype=numpy.int16, count=n).astype(numpy.int64)
+        y = numpy.frombuffer(b, dtype=numpy.int16, count=n).astype(numpy.int64)
+        mixed = (x * k + y * (den - k) + half) >> shift
+        mixed = numpy.clip(mixed, -2**15, 2**15-1).astype(numpy.int16)
+        return {'rate': sound1['rate'], 'pcm': array('h', mixed.tobytes())}
+    q = den - k
+    mixed = array('h', (max(-2**15, min(2**15-1, (x * k + y * q + half) >> shift))
+                        for x, y in zip(a, b)))
+    return {'rate': sound1['rate'], 'pcm': mixed}
+
+
+def _remove_vocals_frames(pcm):
+    """
+    Replace both channels of an interleaved stereo buffer with the saturated
+    difference left - right.
+    """
+    if numpy is not None:
+        x = numpy.frombuffer(pcm, dtype=numpy.int16).astype(numpy.int32)
+        rv = numpy.clip(x[0::2] - x[1::2], -2**15, 2**15-1).astype(numpy.int16)
+        out = numpy.repeat(rv, 2)
+        return array('h', out.tobytes())
+    rv = array('h', (max(-2**15, min(2**15-1, l - r)) for l, r in zip(pcm[0::2], pcm[1::2])))
+    out = array('h', pcm)
+    out[0::2] = rv
+    out[1::2] = rv
+    return out
+
+
+# batch processing
+
+def apply_chain(sound, chain):
+    """
+    Apply a chain of effects to a sound.  The chain is a list of
+    (effect, args) pairs, e.g. [(echo, (5, 0.3, 0.6)), (pan, ())].
+    """
+    for effect, args in chain:
+        sound = effect(sound, *args)
+    return sound
+
+
+def _process_file(job):
+    filename, chain, out_filename = job
+    sound = load_wav(filename, compact=True)
+    write_wav(apply_chain(sound, chain), out_filename)
+    return len(sound['left'])
+
+
+def batch_process(directory, chain, out_directory, workers=None):
+    """
+    Apply a chain of effects (see apply_chain) to every WAV file in the given
+    directory, writing each result under the same name in out_directory.  The
+    files are spread across a pool of worker processes.  Returns a dictionary
+    with the number of files and input samples processed, the elapsed time and
+    the throughput in samples per second.
+    """
+    os.makedirs(out_directory, exist_ok=True)
+    jobs = [(filename, chain, os.path.join(out_directory, os.path.basename(filename)))
+            for filename in sorted(glob.glob(os.path.join(directory, '*.wav')))]
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        samples = sum(pool.map(_process_file, jobs))
+    elapsed = time.perf_counter() - start
+
+    return {
+        'files': len(jobs),
+        'samples': samples,
+        'seconds': elapsed,
+        'samples_per_sec': samples / elapsed if elapsed else 0.0,
+    }
+
+
+# benchmarks
+
+def compare_echo_modes(sound, num_echos, delay, scale, repeat=3):
+    """
+    Time every echo mode on the given sound and compare its output with the
+    direct implementation.  Returns a dictionary mapping each mode to its best
+    time in seconds and its largest absolute difference from 'direct'.
+    """
+    results = {}
+    expected = None
+    for mode in ('direct', 'feedback', 'fft'):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            out = echo(sound, num_echos, delay, scale, mode)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        if expected is None:
+            expected = out
+        error = max((abs(a - b) for ch in ('left', 'right')
+                     for a, b in zip(out[ch], expected[ch])), default=0)
+        assert len(out['left']) == len(expected['left'])
+        results[mode] = {'seconds': best, 'max_error': error}
+    return results
+
+def synthetic_sound(seconds, rate, compact=False):
+    """
+    Return a deterministic stereo test signal of the given length: a chord of
+    sines with different phases on the left and right channels.
+    """
+    n = round(seconds * rate)
+    left = [0.3 * math.sin(2 * math.pi * 220 * i / rate) +
+            0.2 * math.sin(2 * math.pi * 331 * i / rate) for i in range(n)]
+    right = [0.3 * math.sin(2 * math.pi * 220 * i / rate + 1) +
+             0.2 * math.sin(2 * math.pi * 443 * i / rate) for i in range(n)]
+    if compact:
+        return Sound(rate, left, right)
+    return {'rate': rate, 'left': left, 'right': right}
+
+
+BENCHMARK_CASES = {
+    'load_wav': lambda sound, name: load_wav(name),
+    'write_wav': lambda sound, name: write_wav(sound, name),
+    'backwards': lambda sound, name: backwards(sound),
+    'mix': lambda sound, name: mix(sound, sound, 0.3),
+    'echo': lambda sound, name: echo(sound, 5, 0.05, 0.6),
+    'pan': lambda sound, name: pan(sound),
+    'remove_vocals': lambda sound, name: remove_vocals(sound),
+}
+
+
+def benchmark(lengths=(1, 5), rates=(8000, 44100), cases=None, repeat=3, output=None):
+    """
+    Time the lab0 effects and WAV helpers on synthetic stereo signals of every
+    given length (in seconds) and sample rate.  Each result records the best
+    time over repeat runs, the throughput in samples per second and the peak
+    memory (in bytes) allocated during one run.  The list of results is
+    returned and, if output is a filename, also saved there as JSON.
+    """
+    if cases is None:
+        cases = list(BENCHMARK_CASES)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        name = os.path.join(tmp, 'bench.wav')
+        for rate in rates:
+            for seconds in lengths:
+                sound = synthetic_sound(seconds, rate)
+                write_wav(sound, name)
+                n = len(sound['left'])
+                for case in cases:
+                    run = BENCHMARK_CASES[case]
+                    best = None
+                    for _ in range(repeat):
+                        start = time.perf_counter()
+                        run(sound, name)
+                        elapsed = time.perf_counter() - start
+                        best = elapsed if best is None else min(best, elapsed)
+                    tracemalloc.start()
+                    run(sound, name)
+                    peak = tracemalloc.get_traced_memory()[1]
+                    tracemalloc.stop()
+                    results.append({
+                        'case': case,
+                        'rate': rate,
+                        'seconds': seconds,
+                        'samples': n,
+                        'time': best,
+                        'samples_per_sec': n / best if best else None,
+                        'peak_memory': peak,
+                    })
+    if output is not None:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+    return results
+
+
+def compare_benchmarks(baseline, current, tolerance=0.1):
+    """
+    Compare two sets of benchmark results (lists, or names of JSON files
+    written by benchmark) and return the cases whose throughput dropped by
+    more than the given fraction, as (case, rate, seconds, old, new) tuples.
+    """
+    def load(results):
+        if isinstance(results, str):
+            with open(results) as f:
+                results = json.load(f)
+        return {(r['case'], r['rate'], r['seconds']): r['samples_per_sec'] for r in results}
+
+    old = load(baseline)
+    new = load(current)
+    regressions = []
+    for key in sorted(old.keys() & new.keys()):
+        if old[key] and new[key] is not None and new[key] < old[key] * (1 - tolerance):
+            regressions.append(key + (old[key], new[key]))
+    return regressions
+
+
+# opt-in profiling: enable_profiling() wraps every effect so that the duration
+# of each call is appended to EFFECT_TIMINGS[name]; disable_profiling() puts
+# the original functions back
+
+EFFECT_TIMINGS = {}
+
+PROFILED_EFFECTS = ('backwards', 'mix', 'mix_tracks', 'echo', 'pan', 'remove_vocals',
+                    'load_wav', 'write_wav')
+
+
+def profiled(func):
+    """
+    Decorator recording the duration of every call to func in EFFECT_TIMINGS.
+    """
+    @wraps(func)
+    def timed(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            EFFECT_TIMINGS.setdefault(func.__name__, []).append(time.perf_counter() - start)
+    timed.unprofiled = func
+    return timed
+
+
+def enable_profiling():
+    for name in PROFILED_EFFECTS:
+        func = globals()[name]
+        if not hasattr(func, 'unprofiled'):
+            globals()[name] = profiled(func)
+
+
+def disable_profiling():
+    for name in PROFILED_EFFECTS:
+        globals()[name] = getattr(globals()[name], 'unprofiled', globals()[name])
+
+
+# tests
+
+def _assert_close(sound, expected, tolerance=1e-9):
+    assert sound['rate'] == expected['rate']
+    for ch in ('left', 'right'):
+        assert len(sound[ch]) == len(expected[ch])
+        assert all(abs(a - b) <= tolerance for a, b in zip(sound[ch], expected[ch]))
+
+
+def test_echo_engines_match_direct():
+    global numpy
+    saved = numpy
+    sound = synthetic_sound(0.05, 8000)
+    cases = [(3, 0.01, 0.6), (0, 0.01, 0.6), (4, 0, 0.5), (2, 0.0001, -0.7)]
+    try:
+        for numpy in ([saved, None] if saved is not None else [None]):
+            for compact in (False, True):
+                s = Sound.from_dict(sound) if compact else sound
+                for num_echos, delay, scale in cases:
+                    expected = echo(s, num_echos, delay, scale)
+                    for mode in ('feedback', 'fft'):
+                        result = echo(s, num_echos, delay, scale, mode=mode)
+                        assert type(result) is type(expected)
+                        _assert_close(result, expected)
+    finally:
+        numpy = saved
+
+
+def test_resample_blocks_match_resampled():
+    for old, new in ((8000, 11025), (11025, 8000), (8000, 16000), (16000, 8000), (44100, 48000)):
+        sound = synthetic_sound(0.02, old)
+        n = len(sound['left'])
+        expected = resampled(sound, new)
+        assert len(expected['left']) == len(expected['right']) == math.ceil(n * new / old)
+        for block_size in (1, 7, 333, n + 5):
+            blocks = [{'rate': old, 'left': sound['left'][i:i + block_size],
+                       'right': sound['right'][i:i + block_size]}
+                      for i in range(0, n, block_size)]
+            out = list(resample_blocks(blocks, new))
+            assert all(block['rate'] == new for block in out)
+            for ch in ('left', 'right'):
+                assert [x for block in out for x in block[ch]] == expected[ch]
+
+
+def test_mmap_effects_match_effects():
+    with tempfile.TemporaryDirectory() as tmp:
+        stereo = os.path.join(tmp, 'stereo.wav')
+        write_wav(synthetic_sound(0.0125, 8000), stereo)  # 100 frames
+        mono = os.path.join(tmp, 'mono.wav')
+        with wave.open(mono, 'w') as f:
+            f.setparams((1, 2, 8000, 0, 'NONE', 'not compressed'))
+            f.writeframes(_little_endian(array('h', [(i * 997) % 20001 - 10000 for i in range(101)])))
+        out = os.path.join(tmp, 'out.wav')
+
+        for filename in (stereo, mono):
+            expected = backwards(load_wav(filename))
+            for block_size in (1, 7, 13, 50, 1000):
+                backwards_mmap(filename, out, block_size)
+                assert load_wav(out) == expected
+
+        expected = remove_vocals(load_wav(stereo))
+        for block_size in (1, 7, 1000):
+            remove_vocals_mmap(stereo, out, block_size)
+            assert load_wav(out) == expected
+
+        # in place, twice, gives back the original
+        original = load_wav(stereo)
+        backwards_mmap(stereo, block_size=7)
+        assert load_wav(stereo) == backwards(original)
+        backwards_mmap(stereo, block_size=7)
+        assert load_wav(stereo) == original
 
 
 if __name__ == '__main__':
@@ -2,7 +2,18 @@
 
 # NO ADDITIONAL IMPORTS!
 # (except in the last part of the lab; see the lab writeup for details)
+import os
+import sys
+import glob
+import json
 import math
+import time
+import shutil
+import hashlib
+import argparse
+import tracemalloc
+from array import array
+from concurrent.futures import ProcessPoolExecutor
 from PIL import Image
 
 
@@ -16,21 +27,9 @@ def color_filter_from_greyscale_filter(filt):
     input and produces the filtered color image.
     """
     def color_filter(image):
-        rgb = split_color(image)
-
-        # print(image['height'])
-        # print(image['width'])
-        # print(len(image['pixels']))
-        # print(rgb[0]['height'])
-        # print(rgb[0]['width'])
-        # for i in range(3):
-        #     print(len(rgb[i]['pixels']))
-        
-        comb_im = []
-        for i in range(3):
-            comb_im.append(filt(rgb[i]))
-        r = combine_rgb(comb_im)
-        return r
+        if isinstance(image, PlanarImage):
+            return PlanarImage.from_channels([filt(image.channel(i)) for i in range(3)])
+        return combine_rgb([filt(channel) for channel in split_color(image)])
     return color_filter
 
 
@@ -43,7 +42,7 @@ def split_color(image):
     return [{
         'height': image['height'],
         'width': image['width'],
-        'pixels': [image['pixels'][j][i] for j in range(len(image['pixels']))]
+        'pixels': [p[i] for p in image['pixels']]
     } for i in range(3)]
 
 def combine_rgb(rgb_images):
@@ -65,6 +64,66 @@ def combine_rgb(rgb_images):
     #     'pixels': [(rgb_images[j]['pixels'][i] for j in range(3)) for i in range(len(rgb_images[0]['pixels']))]
     # }
 
+class PlanarImage:
+    """
+    A color image stored as three separate flat channels (red, green and
+    blue), each an array of bytes ('B'), or of wider integers ('q') or
+    doubles ('d') if its values do not fit in a byte.  channel returns a
+    greyscale image dictionary whose pixels are the channel array itself, so
+    a greyscale filter can read a channel without it being copied.
+    """
+    def __init__(self, height, width, planes):
+        self.height = height
+        self.width = width
+        self.planes = planes
+
+    @classmethod
+    def from_image(cls, image):
+        """
+        Build a planar copy of a color image dictionary.
+        """
+        pixels = image['pixels']
+        return cls(image['height'], image['width'],
+                   [_plane([p[i] for p in pixels]) for i in range(3)])
+
+    @classmethod
+    def from_channels(cls, images):
+        """
+        Build a planar image from three greyscale images, reusing their
+        pixels if they are already arrays.
+        """
+        planes = []
+        for image in images:
+            pixels = image['pixels']
+            planes.append(pixels if isinstance(pixels, array) else _plane(pixels))
+        return cls(images[0]['height'], images[0]['width'], planes)
+
+    def copy(self):
+        return PlanarImage(self.height, self.width, list(self.planes))
+
+    def channel(self, i):
+        return {'height': self.height, 'width': self.width, 'pixels': self.planes[i]}
+
+    def to_image(self):
+        """
+        Return the image as a color image dictionary of (r, g, b) tuples.
+        """
+        return {'height': self.height, 'width': self.width, 'pixels': list(zip(*self.planes))}
+
+
+def _plane(values):
+    """
+    Store one channel in the narrowest array that holds its values exactly:
+    bytes ('B'), then 64-bit integers ('q'), then doubles ('d').
+    """
+    for typecode in 'Bq':
+        try:
+            return array(typecode, values)
+        except (TypeError, OverflowError):
+            pass
+    return array('d', values)
+
+
 # VARIOUS FILTERS
 
 def make_blur_filter(n):
@@ -97,11 +156,22 @@ def filter_cascade(filters):
 
 # Main Seam Carving Implementation
 
-def seam_carving(image, ncols):
+def seam_carving(image, ncols, incremental=True):
     """
     Starting from the given image, use the seam carving technique to remove
     ncols (an integer) columns from the image.
+
+    With incremental=True (the default) the greyscale values, energy and
+    cumulative energy map are kept between removals and only updated near
+    each removed seam (see SeamCarver); the result is the same as recomputing
+    everything for every column.
     """
+    if incremental:
+        carver = SeamCarver(image)
+        for i in range(ncols):
+            carver.remove(carver.seam())
+        return carver.image()
+
     functions = filter_cascade(
         [greyscale_image_from_color_image, compute_energy, cumulative_energy_map, minimum_energy_seam]
     )
@@ -113,6 +183,374 @@ def seam_carving(image, ncols):
     return output
 
 
+def lowest_energy_seams(image, k):
+    """
+    Find the k seams that seam_carving would remove first, as lists of
+    indices into the given image.  They are found in one carving pass, so no
+    two of them share a pixel.
+    """
+    assert 0 <= k < image['width'], 'can only find fewer seams than columns'
+    carver = SeamCarver(image, track_origins=True)
+    seams = []
+    for i in range(k):
+        seam = carver.seam()
+        seams.append(carver.original_seam(seam))
+        carver.remove(seam)
+    return seams
+
+
+def seam_insertion(image, ncols, mode='average'):
+    """
+    Content-aware enlarging: widen the image by ncols columns by inserting a
+    new pixel next to every pixel of the ncols lowest-energy seams (see
+    lowest_energy_seams).  With mode='average' the new pixel is the average
+    of the seam pixel and its right neighbour (its left one at the right
+    edge); with mode='duplicate' it is a copy of the seam pixel.
+
+    At most width - 1 seams can be found in one image, so larger
+    enlargements are done in rounds, each inserting up to width - 1 seams
+    into the result of the previous round.
+    """
+    assert mode in ('average', 'duplicate'), 'unknown mode: %r' % mode
+    assert ncols == 0 or image['width'] > 1, 'cannot find seams in an image one pixel wide'
+    while ncols > image['width'] - 1:
+        step = image['width'] - 1
+        image = _insert_seams(image, step, mode)
+        ncols -= step
+    return _insert_seams(image, ncols, mode)
+
+
+def _insert_seams(image, ncols, mode):
+    width = image['width']
+    height = image['height']
+    pixels = image['pixels']
+    inserted = [[] for _ in range(height)]
+    for seam in lowest_energy_seams(image, ncols):
+        for row, column in enumerate(seam_columns(seam, width, height)):
+            inserted[row].append(column)
+
+    out = []
+    for row, columns in enumerate(inserted):
+        start = row * width
+        for column in sorted(columns):
+            index = row * width + column
+            out += pixels[start:index + 1]
+            if mode == 'duplicate':
+                out.append(pixels[index])
+            else:
+                other = pixels[index + 1] if column < width - 1 else pixels[index - 1]
+                out.append(_average_pixel(pixels[index], other))
+            start = index + 1
+        out += pixels[start:(row + 1) * width]
+    return {'height': height, 'width': width + ncols, 'pixels': out}
+
+
+def _average_pixel(a, b):
+    if isinstance(a, tuple):
+        return tuple(round((x + y) / 2) for x, y in zip(a, b))
+    return round((a + b) / 2)
+
+
+def seam_carving_rows(image, nrows):
+    """
+    Like seam_carving, but remove nrows rows using horizontal seams.
+    """
+    carver = SeamCarver(image)
+    for i in range(nrows):
+        carver.remove(carver.seam(True), True)
+    return carver.image()
+
+
+def seam_carving_to_size(image, height, width):
+    """
+    Seam carve the image down to the given height and width.  While both
+    dimensions are too large, each step removes whichever of the best
+    vertical and horizontal seams has the lower total energy (the vertical
+    one on ties).
+    """
+    assert 0 < height <= image['height'] and 0 < width <= image['width']
+    carver = SeamCarver(image)
+    while carver.height > height or carver.width > width:
+        if carver.height == height:
+            transposed = False
+        elif carver.width == width:
+            transposed = True
+        else:
+            transposed = carver.seam_energy(True) < carver.seam_energy(False)
+        carver.remove(carver.seam(transposed), transposed)
+    return carver.image()
+
+
+class SeamCarver:
+    """
+    The state of an image being seam carved: its color pixels, greyscale
+    values, energy and cumulative energy map, all as flat row-major lists.
+
+    Removing a seam only changes the energy of pixels whose 3x3 neighbourhood
+    touched it, so remove recomputes energy only in a narrow band around the
+    seam.  In the cumulative energy map, an entry can only change if its
+    energy changed, if the seam altered which pixels sit above it, or if one
+    of the three entries above it changed value; each row is rebuilt only
+    over the span of columns where one of those happened, and the rest is
+    kept from the previous map.
+
+    Horizontal seams (removing a row) use the same code on a transposed view
+    of the buffers: logical pixel (i, j) lives at index i*si + j*sj, with
+    strides (si, sj) = (1, width) instead of (width, 1), so nothing is ever
+    physically transposed.  The Sobel magnitude is the same on the transposed
+    image, so both directions share one energy buffer; each has its own
+    cumulative energy map, and the one for the direction not just carved is
+    rebuilt in full the next time it is needed.
+    """
+    def __init__(self, image, track_origins=False):
+        self.height = image['height']
+        self.width = image['width']
+        self.pixels = list(image['pixels'])
+        # with track_origins, the index each remaining pixel had in the
+        # original image, so removed seams can be mapped back to it
+        self.origins = list(range(len(self.pixels))) if track_origins else None
+        grey = greyscale_image_from_color_image(image)
+        energy = compute_energy(grey)
+        self.grey = grey['pixels']
+        self.energy = energy['pixels']
+        self.cem = cumulative_energy_map(energy)['pixels']
+        self.cem_rows = None
+
+    def image(self):
+        return {'height': self.height, 'width': self.width, 'pixels': list(self.pixels)}
+
+    def _view(self, transposed):
+        """
+        Logical height, width and strides (si, sj) for one seam direction.
+        """
+        if transposed:
+            return self.width, self.height, 1, self.width
+        return self.height, self.width, self.width, 1
+
+    def _cumulative(self, transposed):
+        cem = self.cem_rows if transposed else self.cem
+        if cem is None:
+            height, width, si, sj = self._view(transposed)
+            cem = [0] * len(self.energy)
+            _update_cem(cem, self.energy, height, width, si, sj, [(0, width - 1)] * height)
+            if transposed:
+                self.cem_rows = cem
+            else:
+                self.cem = cem
+        return cem
+
+    def seam(self, transposed=False):
+        """
+        Return the minimum-energy seam of the current image, as a list of
+        indices into its pixels (see minimum_energy_seam).  With
+        transposed=True the seam runs left to right and removes a row.
+        """
+        cem = self._cumulative(transposed)
+        if not transposed:
+            return minimum_energy_seam({'height': self.height, 'width': self.width, 'pixels': cem})
+        height, width, si, sj = self._view(True)
+        return _strided_seam(cem, height, width, si, sj)
+
+    def seam_energy(self, transposed=False):
+        """
+        Total energy of the seam that seam(transposed) would return.
+        """
+        cem = self._cumulative(transposed)
+        height, width, si, sj = self._view(transposed)
+        return min(cem[(height - 1) * si + j * sj] for j in range(width))
+
+    def original_seam(self, seam):
+        """
+        Map a seam of the current image to indices into the original image
+        (needs track_origins=True).
+        """
+        return [self.origins[i] for i in seam]
+
+    def remove(self, seam, transposed=False):
+        """
+        Remove the given seam (as returned by seam) from the image, updating
+        the greyscale, energy and cumulative energy buffers.
+        """
+        w = self.width
+        columns = seam_columns(seam, w, self.height, transposed)
+        buffers = [self.pixels, self.grey, self.energy]
+        if self.origins is not None:
+            buffers.append(self.origins)
+        if transposed:
+            if self.cem_rows is not None:
+                buffers.append(self.cem_rows)
+            for buf in buffers:
+                _remove_rows(buf, w, columns)
+            self.height -= 1
+            self.cem = None
+        else:
+            if self.cem is not None:
+                buffers.append(self.cem)
+            for buf in buffers:
+                _remove_columns(buf, w, columns)
+            self.width -= 1
+            self.cem_rows = None
+        h, w = self.height, self.width
+        height, width, si, sj = self._view(transposed)
+        if width == 0:
+            return
+
+        # energy: only pixels next to the seam in this row or the rows
+        # above and below can see a different neighbourhood
+        energy = self.energy
+        changed = [None] * height
+        for i in range(height):
+            near = columns[max(i - 1, 0):i + 2]
+            for j in range(max(min(near) - 1, 0), min(max(near), width - 1) + 1):
+                row, column = (j, i) if transposed else (i, j)
+                value = _sobel_at(self.grey, h, w, row, column)
+                if value != energy[i * si + j * sj]:
+                    energy[i * si + j * sj] = value
+                    changed[i] = _hull(changed[i], j, j)
+
+        # cumulative energy map: a row is rebuilt where its energy changed,
+        # where the seam shifted the pixels above it (see _update_cem for
+        # changes coming from the row above)
+        cem = self.cem_rows if transposed else self.cem
+        if cem is None:
+            return
+        spans = changed[:1]
+        for i in range(1, height):
+            adjacent = columns[i - 1:i + 1]
+            spans.append(_hull(changed[i], max(min(adjacent) - 1, 0), min(max(adjacent), width - 1)))
+        _update_cem(cem, energy, height, width, si, sj, spans)
+
+
+def _update_cem(cem, energy, height, width, si, sj, spans):
+    """
+    Recompute the cumulative energy map cem (laid out with strides si, sj, as
+    in SeamCarver) in place, given spans[i], the (lo, hi) range of row i
+    known to be out of date (or None).  An entry of a row is also rebuilt if
+    one of the three entries above it actually changed value, so the rebuilt
+    part of the map only spreads as far as the changes do.
+    """
+    changed = None
+    dirty = spans[0]
+    if dirty is not None:
+        changed = _replace_span(cem, 0, sj, dirty, energy[dirty[0] * sj:dirty[1] * sj + 1:sj])
+    for i in range(1, height):
+        dirty = spans[i]
+        if changed is not None:
+            dirty = _hull(dirty, max(changed[0] - 1, 0), min(changed[1] + 1, width - 1))
+        if dirty is None:
+            changed = None
+            continue
+        lo, hi = dirty
+        start = i * si
+        above = start - si
+        up = cem[above + lo * sj:above + hi * sj + 1:sj]
+        left = [cem[above + max(lo - 1, 0) * sj]] + up[:-1]
+        right = up[1:] + [cem[above + min(hi + 1, width - 1) * sj]]
+        values = [e + min(a, b, c) for e, a, b, c
+                  in zip(energy[start + lo * sj:start + hi * sj + 1:sj], left, up, right)]
+        changed = _replace_span(cem, start, sj, dirty, values)
+
+
+def _replace_span(cem, start, sj, span, values):
+    """
+    Write values over columns span[0]..span[1] of the row of cem starting at
+    start, returning the (lo, hi) range of columns that changed (or None).
+    """
+    lo, hi = span
+    old = cem[start + lo * sj:start + hi * sj + 1:sj]
+    diffs = [j for j, (a, b) in enumerate(zip(old, values)) if a != b]
+    if not diffs:
+        return None
+    cem[start + lo * sj:start + hi * sj + 1:sj] = values
+    return (lo + diffs[0], lo + diffs[-1])
+
+
+def _strided_seam(cem, height, width, si, sj):
+    """
+    minimum_energy_seam for a cumulative energy map laid out with strides
+    si, sj; ties go to the larger column, as there.
+    """
+    i = height - 1
+    best = 0
+    for j in range(width):
+        if cem[i * si + j * sj] <= cem[i * si + best * sj]:
+            best = j
+    seam = [i * si + best * sj]
+    for i in range(height - 2, -1, -1):
+        below = best
+        for j in range(max(below - 1, 0), min(below + 1, width - 1) + 1):
+            if cem[i * si + j * sj] <= cem[i * si + best * sj]:
+                best = j
+        seam.append(i * si + best * sj)
+    return seam
+
+
+def _hull(span, lo, hi):
+    """
+    Smallest (lo, hi) column range covering span (or None) and lo..hi.
+    """
+    if span is None:
+        return (lo, hi)
+    return (min(span[0], lo), max(span[1], hi))
+
+
+def _remove_rows(pixels, width, rows):
+    """
+    Remove rows[c] from each column c of a flat row-major list in place,
+    moving the pixels below it up by one.
+    """
+    height = len(pixels) // width
+    for row in range(height - 1):
+        start = row * width
+        pixels[start:start + width] = [
+            here if row < removed else below
+            for here, below, removed in zip(pixels[start:start + width], pixels[start + width:start + 2 * width], rows)
+        ]
+    del pixels[(height - 1) * width:]
+
+
+def _remove_columns(pixels, width, columns):
+    """
+    Remove columns[r] from each row r of a flat row-major list in place,
+    shifting the rest of the buffer left in one pass.
+    """
+    write = 0
+    for row, column in enumerate(columns):
+        start = row * width
+        for lo, hi in ((start, start + column), (start + column + 1, start + width)):
+            if write != lo:
+                pixels[write:write + hi - lo] = pixels[lo:hi]
+            write += hi - lo
+    del pixels[write:]
+
+
+def _without_columns(pixels, width, columns):
+    """
+    Copy of a flat row-major buffer with columns[r] removed from each row r.
+    """
+    out = []
+    for row, column in enumerate(columns):
+        start = row * width
+        out += pixels[start:start + column]
+        out += pixels[start + column + 1:start + width]
+    return out
+
+
+def _sobel_at(grey, height, width, row, column):
+    """
+    Value of sobel_magnitude at one pixel of a flat greyscale buffer.
+    """
+    top = max(row - 1, 0) * width
+    middle = row * width
+    bottom = min(row + 1, height - 1) * width
+    left = max(column - 1, 0)
+    right = min(column + 1, width - 1)
+    a0, a1, a2 = grey[top + left], grey[top + column], grey[top + right]
+    b0, b2 = grey[middle + left], grey[middle + right]
+    c0, c1, c2 = grey[bottom + left], grey[bottom + column], grey[bottom + right]
+    gx = a2 - a0 + 2*(b2 - b0) + c2 - c0
+    gy = c0 + 2*c1 + c2 - a0 - 2*a1 - a2
+    return min(255, round(math.sqrt(gx * gx + gy * gy)))
 # Optional Helper Functions for Seam Carving
 
 def greyscale_image_from_color_image(image):
@@ -303,22 +741,79 @@ def image_without_seam(image, seam):
     return a new image (without modifying the original) that contains all the
     pixels from the original image except those corresponding to the locations
     in the given list.
-    """
-    # print(seam)
 
+    The seam must hold exactly one index per row; the new pixels are built in
+    a single row-by-row pass.
+    """
+    width = image['width']
+    columns = seam_columns(seam, width, image['height'])
     return {
         'height': image['height'],
-        'width': image['width'] - 1,
-        'pixels': [image['pixels'][i] for i in range(image['height'] * image['width']) if i not in seam]
+        'width': width - 1,
+        'pixels': _without_columns(image['pixels'], width, columns)
     }
 
 
+def remove_seam(image, seam):
+    """
+    Remove the given seam (one index per row) from the image in place,
+    compacting its pixels list row by row, and return the image.
+    """
+    width = image['width']
+    columns = seam_columns(seam, width, image['height'])
+    _remove_columns(image['pixels'], width, columns)
+    image['width'] = width - 1
+    return image
+
+
+def image_without_seams(image, seams):
+    """
+    Return a new image without any of the given seams, removed in a single
+    pass.  The seams are lists of indices into the original image (as
+    returned by minimum_energy_seam) and must not share any pixel.
+    """
+    width = image['width']
+    height = image['height']
+    pixels = image['pixels']
+    removed = [[] for _ in range(height)]
+    for seam in seams:
+        for row, column in enumerate(seam_columns(seam, width, height)):
+            removed[row].append(column)
+
+    out = []
+    for row, columns in enumerate(removed):
+        start = row * width
+        for column in sorted(columns):
+            out += pixels[start:row * width + column]
+            start = row * width + column + 1
+        out += pixels[start:(row + 1) * width]
+    return {'height': height, 'width': width - len(seams), 'pixels': out}
+
+
+def seam_columns(seam, width, height, transposed=False):
+    """
+    Given a seam as a list of indices (one per row, in any order), return
+    the list of its column in each row, from top to bottom.  With
+    transposed=True the seam has one index per column instead, and the
+    result is its row in each column, from left to right.
+    """
+    columns = [None] * (width if transposed else height)
+    for index in seam:
+        row, column = divmod(index, width)
+        if transposed:
+            columns[column] = row
+        else:
+            columns[row] = column
+    assert None not in columns, 'seam must have one pixel in every row'
+    return columns
+
+
 # HELPER FUNCTIONS FOR LOADING AND SAVING IMAGES
 
-def load_color_image(filename):
+def load_color_image(filename, planar=False):
     """
     Loads a color image from the given file and returns a dictionary
-    representing that image.
+    representing that image, or a PlanarImage if planar is True.
 
     Invoked as, for example:
        i = load_color_image('test_images/cat.png')
@@ -326,6 +821,9 @@ def load_color_image(filename):
     with open(filename, 'rb') as img_handle:
         img = Image.open(img_handle)
         img = img.convert('RGB')  # in case we were given a greyscale image
+        if planar:
+            w, h = img.size
+            return PlanarImage(h, w, [array('B', band.tobytes()) for band in img.split()])
         img_data = img.getdata()
         pixels = list(img_data)
         w, h = img.size
@@ -336,10 +834,17 @@ def save_color_image(image, filename, mode='PNG'):
     Saves the given color image to disk or to a file-like object.  If filename
     is given as a string, the file type will be inferred from the given name.
     If filename is given as a file-like object, the file type will be
-    determined by the 'mode' parameter.
+    determined by the 'mode' parameter.  The image can also be a PlanarImage.
     """
-    out = Image.new(mode='RGB', size=(image['width'], image['height']))
-    out.putdata(image['pixels'])
+    if isinstance(image, PlanarImage):
+        size = (image.width, image.height)
+        out = Image.merge('RGB', [
+            Image.frombytes('L', size, (plane if plane.typecode == 'B' else array('B', plane)).tobytes())
+            for plane in image.planes
+        ])
+    else:
+        out = Image.new(mode='RGB', size=(image['width'], image['height']))
+        out.putdata(image['pixels'])
     if isinstance(filename, str):
         out.save(filename)
     else:
@@ -400,17 +905,53 @@ def set_pixel(image, x, y, c):
 
 
 def apply_per_pixel(image, func):
-    result = {
+    return {
         'height': image['height'],
         'width': image['width'],
-        'pixels': [0] * (image['height'] * image['width']),
+        'pixels': [func(c) for c in image['pixels']],
     }
-    for x in range(image['height']):
-        for y in range(image['width']):
-            color = get_pixel(image, x, y)
-            newcolor = func(color)
-            set_pixel(result, x, y, newcolor)
-    return result
+
+class PaddedImage:
+    """
+    A greyscale image stored as one flat array with a border of pad pixels on
+    every side, filled by extending the edge pixels outwards (the same values
+    get_pixel returns for out-of-range coordinates).  Pixel (x, y) is at
+    pixels[(x + pad) * stride + y + pad], so any pixel within pad of the
+    image can be read directly, without clamping.  The array holds bytes
+    ('B') for ordinary 0-255 images, 64-bit integers ('q') for other integer
+    images and doubles ('d') for anything else.
+    """
+    def __init__(self, height, width, pad, pixels):
+        self.height = height
+        self.width = width
+        self.pad = pad
+        self.stride = width + 2 * pad
+        self.pixels = pixels
+
+    @classmethod
+    def from_image(cls, image, pad):
+        """
+        Build a padded copy of a 6.009 image dictionary.
+        """
+        h = image['height']
+        w = image['width']
+        src = image['pixels']
+        rows = []
+        for x in range(h):
+            row = src[x*w:(x+1)*w]
+            rows.append([row[0]] * pad + list(row) + [row[-1]] * pad)
+        flat = []
+        for row in [rows[0]] * pad + rows + [rows[-1]] * pad:
+            flat.extend(row)
+        for typecode in 'Bq':
+            try:
+                return cls(h, w, pad, array(typecode, flat))
+            except (TypeError, OverflowError):
+                pass
+        return cls(h, w, pad, array('d', flat))
+
+    def index(self, x, y):
+        return (x + self.pad) * self.stride + y + self.pad
 
 def correlate(image, kernel):
     """
@@ -429,24 +970,23 @@ def correlate(image, kernel):
     """
     assert kernel['dim'] % 2 == 1, 'dimension of kernel should be odd'
     assert round(len(kernel['num'])**0.5) == kernel['dim'], 'invalid kernal'
-    result = {
-        'height': image['height'],
-        'width': image['width'],
-        'pixels': [0] * (image['height'] * image['width']),
-    }
-    offset = (kernel['dim']-1)//2
-
+    dim = kernel['dim']
+    w = image['width']
+    padded = PaddedImage.from_image(image, dim // 2)
+    buf = padded.pixels
+    taps = [(i * padded.stride + j, weight)
+            for i in range(dim) for j in range(dim)
+            for weight in (kernel['num'][i*dim + j],) if weight]
+
+    pixels = []
     for x in range(image['height']):
-        for y in range(image['width']):
-            row = x-offset
-            column = y-offset
-            color = 0
-            for i in range(kernel['dim']):
-                for j in range(kernel['dim']):
-                    color += get_pixel(image, row+i, column+j) * kernel['num'][i*kernel['dim']+j]
-            set_pixel(result, x, y, color)
-    
-    return result
+        corner = x * padded.stride
+        acc = [0] * w
+        for offset, weight in taps:
+            start = corner + offset
+            acc = [a + p * weight for a, p in zip(acc, buf[start:start + w])]
+        pixels.extend(acc)
+    return {'height': image['height'], 'width': w, 'pixels': pixels}
 
 def round_and_clip_image(image):
     """
@@ -518,19 +1058,343 @@ def edges(image):
     This process should not mutate the input image; rather, it should create a
     separate structure to represent the output.
     """    
-    x = correlate(image, k_x)
-    y = correlate(image, k_y)
+    return sobel_magnitude(image)
+
+
+def sobel_magnitude(image):
+    """
+    Fused Sobel operator: a single sweep over the edge-padded image that reads
+    each 3x3 neighbourhood once, combines the k_x and k_y responses and writes
+    the rounded, clipped magnitude straight into the only output buffer.
+    Gives the same result as correlating with k_x and k_y separately.
+    """
+    h = image['height']
+    w = image['width']
+    padded = PaddedImage.from_image(image, 1)
+    buf = padded.pixels
+    stride = padded.stride
+    sqrt = math.sqrt
+
+    pixels = []
+    for x in range(h):
+        top = x * stride
+        mid = top + stride
+        bot = mid + stride
+        pixels.extend([
+            min(255, round(sqrt((a2 - a0 + 2*(b2 - b0) + c2 - c0)**2 +
+                                (c0 + 2*c1 + c2 - a0 - 2*a1 - a2)**2)))
+            for a0, a1, a2, b0, b2, c0, c1, c2 in zip(
+                buf[top:top+w], buf[top+1:top+1+w], buf[top+2:top+2+w],
+                buf[mid:mid+w], buf[mid+2:mid+2+w],
+                buf[bot:bot+w], buf[bot+1:bot+1+w], buf[bot+2:bot+2+w])
+        ])
+    return {'height': h, 'width': w, 'pixels': pixels}
+
+
+# BENCHMARKS
+#
+# benchmark_images times the filters of lab 1 and lab 2 on synthetic square
+# images of the given sizes (e.g. 64 up to 4096), reporting pixels per second
+# and peak memory for every case and backend.  The 'lab2' backend is the code
+# in this file; if lab1 can be imported, the greyscale filters are also timed
+# with its 'python' and (when NumPy is available) 'numpy' backends.
+
+def synthetic_color_image(size):
+    """
+    Return a deterministic size-by-size color test image with smooth
+    gradients and sharp edges.
+    """
+    pixels = []
+    for x in range(size):
+        for y in range(size):
+            pixels.append(((x * 255) // size,
+                           (y * 255) // size,
+                           255 if (x // 16 + y // 16) % 2 else (x * y) % 256))
+    return {'height': size, 'width': size, 'pixels': pixels}
+
+
+IMAGE_BENCHMARK_CASES = {
+    'correlate': lambda m, grey, color: m.correlate(grey, m.k_x),
+    'blurred': lambda m, grey, color: m.blurred(grey, 5),
+    'sharpened': lambda m, grey, color: m.sharpened(grey, 5),
+    'edges': lambda m, grey, color: m.edges(grey),
+    'color_filter_from_greyscale_filter':
+        lambda m, grey, color: color_filter_from_greyscale_filter(make_blur_filter(3))(color),
+    'color_filter_planar':
+        lambda m, grey, color: color_filter_from_greyscale_filter(make_blur_filter(3))(
+            PlanarImage.from_image(color)),
+    'seam_carving': lambda m, grey, color: seam_carving(color, 1),
+}
+
+GREYSCALE_CASES = ('correlate', 'blurred', 'sharpened', 'edges')
+
+
+def _backends():
+    """
+    Return a list of (name, module, setup) for every available backend.
+    """
+    backends = [('lab2', sys.modules[__name__], None)]
+    try:
+        import lab1
+    except ImportError:
+        return backends
+    backends.append(('lab1-python', lab1, lambda: lab1.set_backend('python')))
+    if lab1.numpy is not None:
+        backends.append(('lab1-numpy', lab1, lambda: lab1.set_backend('numpy')))
+    return backends
+
+
+def benchmark_images(sizes=(64, 128, 256), cases=None, backends=None, repeat=1, output=None):
+    """
+    Time each case on size-by-size synthetic images.  Greyscale cases are run
+    with every backend (or only those named in backends), the color cases
+    with this file's code.  Each result records the best time over repeat
+    runs, the throughput in pixels per second and the peak memory (in bytes)
+    allocated during one run.  The results are returned and, if output is a
+    filename, also saved there as JSON.
+    """
+    if cases is None:
+        cases = list(IMAGE_BENCHMARK_CASES)
+    available = [b for b in _backends() if backends is None or b[0] in backends]
+    lab1 = sys.modules.get('lab1')
+    previous_backend = getattr(lab1, 'BACKEND', None)
+    results = []
+    for size in sizes:
+        color = synthetic_color_image(size)
+        grey = greyscale_image_from_color_image(color)
+        for case in cases:
+            run = IMAGE_BENCHMARK_CASES[case]
+            for name, module, setup in available:
+                if case not in GREYSCALE_CASES and name != 'lab2':
+                    continue
+                if setup is not None:
+                    setup()
+                best = None
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    run(module, grey, color)
+                    elapsed = time.perf_counter() - start
+                    best = elapsed if best is None else min(best, elapsed)
+                tracemalloc.start()
+                run(module, grey, color)
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                results.append({
+                    'case': case,
+                    'backend': name,
+                    'size': size,
+                    'pixels': size * size,
+                    'time': best,
+                    'pixels_per_sec': size * size / best if best else None,
+                    'peak_memory': peak,
+                })
+    if previous_backend is not None:
+        lab1.set_backend(previous_backend)
+    if output is not None:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+    return results
+
+
+def compare_image_benchmarks(baseline, current, tolerance=0.1):
+    """
+    Compare two sets of results of benchmark_images (lists, or names of JSON
+    files) and return the cases whose throughput dropped by more than the
+    given fraction, as (case, backend, size, old, new) tuples.
+    """
+    def load(results):
+        if isinstance(results, str):
+            with open(results) as f:
+                results = json.load(f)
+        return {(r['case'], r['backend'], r['size']): r['pixels_per_sec'] for r in results}
+
+    old = load(baseline)
+    new = load(current)
+    regressions = []
+    for key in sorted(old.keys() & new.keys()):
+        if old[key] and new[key] is not None and new[key] < old[key] * (1 - tolerance):
+            regressions.append(key + (old[key], new[key]))
+    return regressions
+
+
+# COMMAND LINE INTERFACE
+#
+# Runs a cascade of color filters over many files, e.g.
+#
+#   python3 lab2.py 'test_images/*.png' blur:5,sharpen:3,edges -o out
+#
+# Files are spread over a pool of worker processes, and every result is also
+# stored in a cache directory under a hash of the input file's contents and
+# the filter spec, so re-running a pipeline skips inputs that have not changed.
+
+FILTER_SPECS = {
+    'blur': lambda n: color_filter_from_greyscale_filter(make_blur_filter(n)),
+    'sharpen': lambda n: color_filter_from_greyscale_filter(make_sharpen_filter(n)),
+    'edges': lambda: color_filter_from_greyscale_filter(edges),
+    'invert': lambda: color_filter_from_greyscale_filter(inverted),
+    'carve': lambda n: lambda image: seam_carving(
+        image.to_image() if isinstance(image, PlanarImage) else image, n),
+}
+
 
-    return round_and_clip_image({
-        'height': x['height'],
-        'width': x['width'],
-        'pixels': [round((x['pixels'][i]**2 + y['pixels'][i]**2)**0.5) for i in range(len(x['pixels']))]
-    })
+def parse_filter_spec(spec):
+    """
+    Given a filter spec such as 'blur:5,sharpen:3,edges', return the
+    corresponding cascade of color filters.
+    """
+    filters = []
+    for item in spec.split(','):
+        name, *args = item.strip().split(':')
+        if name not in FILTER_SPECS:
+            raise ValueError('unknown filter: %r' % name)
+        try:
+            filters.append(FILTER_SPECS[name](*(int(arg) for arg in args)))
+        except (TypeError, ValueError):
+            raise ValueError('bad arguments for filter %r: %r' % (name, item))
+    return filter_cascade(filters)
+
+
+def _cache_key(filename, spec):
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    digest.update(b'\0' + ','.join(i.strip() for i in spec.split(',')).encode())
+    return digest.hexdigest()
+
+
+def _run_filter_job(job):
+    """
+    Filter one file (or fetch the result from the cache).  Returns True if
+    the cached result was used.
+    """
+    filename, spec, out_filename, cache_dir = job
+    cached = os.path.join(cache_dir, _cache_key(filename, spec) + '.png')
+    hit = os.path.exists(cached)
+    if not hit:
+        result = parse_filter_spec(spec)(load_color_image(filename, planar=True))
+        partial_name = '%s.%d.tmp' % (cached, os.getpid())
+        with open(partial_name, 'wb') as f:
+            save_color_image(result, f, 'PNG')
+        os.replace(partial_name, cached)
+    shutil.copyfile(cached, out_filename)
+    return hit
+
+
+def _output_names(files, output):
+    """
+    Output filename for each input: its path relative to the directory all
+    inputs share, under output, with the extension replaced by '.png'.
+    """
+    base = os.path.commonpath([os.path.dirname(os.path.abspath(f)) for f in files])
+    return [os.path.join(output, os.path.splitext(os.path.relpath(os.path.abspath(f), base))[0] + '.png')
+            for f in files]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Apply a cascade of filters to many images.')
+    parser.add_argument('pattern', help="glob of input images, e.g. 'test_images/*.png' or 'in/**/*.png'")
+    parser.add_argument('spec', help='comma-separated filters: blur:N, sharpen:N, edges, invert, carve:N')
+    parser.add_argument('-o', '--output', default='filtered', help='output directory')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='number of worker processes')
+    parser.add_argument('--cache', default='.filter_cache', help='cache directory')
+    args = parser.parse_args(argv)
+
+    try:
+        parse_filter_spec(args.spec)
+    except ValueError as e:
+        parser.error(str(e))
+    files = sorted(glob.glob(args.pattern, recursive=True))
+    if not files:
+        parser.error('no files match %r' % args.pattern)
+
+    outputs = _output_names(files, args.output)
+    seen = {}
+    for filename, out_filename in zip(files, outputs):
+        if out_filename in seen:
+            parser.error('%r and %r would both be written to %r'
+                         % (seen[out_filename], filename, out_filename))
+        seen[out_filename] = filename
+
+    os.makedirs(args.cache, exist_ok=True)
+    for out_filename in outputs:
+        os.makedirs(os.path.dirname(out_filename), exist_ok=True)
+    jobs = [(filename, args.spec, out_filename, args.cache)
+            for filename, out_filename in zip(files, outputs)]
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        hits = sum(pool.map(_run_filter_job, jobs))
+    print('%d files: %d filtered, %d from cache' % (len(files), len(files) - hits, hits))
+    return 0
+
+
+# TEST FUNCTIONS
+
+def _noise_color_image(height, width, levels=256, seed=1):
+    """
+    Deterministic pseudo-random color image; a small number of levels gives
+    many equal energies, which exercises the tie-breaking of the seams.
+    """
+    pixels = []
+    state = seed
+    for _ in range(height * width):
+        pixel = []
+        for _ in range(3):
+            state = (state * 1103515245 + 12345) % 2**31
+            pixel.append((state >> 16) % levels * (255 // max(levels - 1, 1)))
+        pixels.append(tuple(pixel))
+    return {'height': height, 'width': width, 'pixels': pixels}
+
+
+def _transposed(image):
+    h = image['height']
+    w = image['width']
+    return {'height': w, 'width': h,
+            'pixels': [image['pixels'][x * w + y] for y in range(w) for x in range(h)]}
+
+
+def test_color_filter_float_copy():
+    def halved(image):
+        out = {'height': image['height'], 'width': image['width'], 'pixels': image['pixels'][:]}
+        for i, c in enumerate(out['pixels']):
+            out['pixels'][i] = c / 2
+        return out
+
+    def shifted(image):
+        pixels = image['pixels']
+        return {'height': image['height'], 'width': image['width'],
+                'pixels': pixels[:1] + [0] * (len(pixels) - 1)}
+
+    im = {'height': 1, 'width': 2, 'pixels': [(10, 20, 30), (40, 50, 60)]}
+    assert color_filter_from_greyscale_filter(halved)(im) == {
+        'height': 1, 'width': 2, 'pixels': [(5.0, 10.0, 15.0), (20.0, 25.0, 30.0)]}
+    assert color_filter_from_greyscale_filter(shifted)(im) == {
+        'height': 1, 'width': 2, 'pixels': [(10, 20, 30), (0, 0, 0)]}
+    planar = color_filter_from_greyscale_filter(inverted)(PlanarImage.from_image(im))
+    assert planar.to_image() == color_filter_from_greyscale_filter(inverted)(im)
+
+
+def test_seam_carving_incremental():
+    for seed, (height, width, levels) in enumerate([(9, 12, 256), (12, 9, 2), (7, 15, 3), (1, 6, 256)]):
+        im = _noise_color_image(height, width, levels, seed)
+        for ncols in (1, width // 2, width - 2):
+            expected = seam_carving(im, ncols, incremental=False)
+            assert seam_carving(im, ncols) == expected
+            assert image_without_seams(im, lowest_energy_seams(im, ncols)) == expected
+
+
+def test_seam_carving_rows():
+    for seed, (height, width, levels) in enumerate([(12, 9, 256), (9, 12, 2), (15, 7, 3)]):
+        im = _noise_color_image(height, width, levels, seed)
+        for nrows in (1, height // 2, height - 2):
+            expected = _transposed(seam_carving(_transposed(im), nrows, incremental=False))
+            assert seam_carving_rows(im, nrows) == expected
 
 
 # MAIN
 
 if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        sys.exit(main())
 
     # i_inv = load_color_image('test_images/cat.png')
     # save_color_image(color_filter_from_greyscale_filter(inverted)(i_inv), 'inverted.png')